@@ -20,7 +20,9 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from multiprocessing import cpu_count
 from tempfile import NamedTemporaryFile
 
 from .gdal import Dataset, preprocess
@@ -32,7 +34,7 @@ from .vips import TmsPyramid, validate_resolutions
 def image_mbtiles(inputfile, outputfile, metadata,
                   min_resolution=None, max_resolution=None, fill_borders=None,
                   zoom_offset=None, colors=None, renderer=None,
-                  preprocessor=None, pngdata=None):
+                  preprocessor=None, pngdata=None, hasher=None):
     """
     Slices a GDAL-readable inputfile into a pyramid of PNG tiles.
 
@@ -48,6 +50,7 @@ def image_mbtiles(inputfile, outputfile, metadata,
                                   10: rgba(255, 255, 255, 255)})
             Defaults to no colorization.
     preprocessor: Function to run on the TmsPyramid before slicing.
+    hasher: Function used to find duplicate tiles. Defaults to intmd5.
 
     If `min_resolution` is None, don't downsample.
     If `max_resolution` is None, don't upsample.
@@ -59,10 +62,13 @@ def image_mbtiles(inputfile, outputfile, metadata,
     if renderer is None:
         renderer = PngRenderer(**pngdata)
 
-    with MbtilesStorage.create(filename=outputfile,
-                               metadata=metadata,
-                               zoom_offset=zoom_offset,
-                               renderer=renderer) as storage:
+    with ThreadPoolExecutor(max_workers=cpu_count()) as pool, \
+            MbtilesStorage.create(filename=outputfile,
+                                  metadata=metadata,
+                                  zoom_offset=zoom_offset,
+                                  renderer=renderer,
+                                  pool=pool,
+                                  hasher=hasher) as storage:
         pyramid = TmsPyramid(inputfile=inputfile,
                              storage=storage,
                              min_resolution=min_resolution,
@@ -89,7 +95,7 @@ def image_mbtiles(inputfile, outputfile, metadata,
 
 def image_pyramid(inputfile, outputdir,
                   min_resolution=None, max_resolution=None, fill_borders=None,
-                  colors=None, renderer=None, preprocessor=None):
+                  colors=None, renderer=None, preprocessor=None, hasher=None):
     """
     Slices a GDAL-readable inputfile into a pyramid of PNG tiles.
 
@@ -99,6 +105,7 @@ def image_pyramid(inputfile, outputdir,
     max_resolution: Maximum resolution to upsample tiles.
     fill_borders: Fill borders of image with empty tiles.
     preprocessor: Function to run on the TmsPyramid before slicing.
+    hasher: Function used to find duplicate tiles. Defaults to intmd5.
 
     Filenames are in the format ``{tms_z}/{tms_x}/{tms_y}.png``.
 
@@ -110,20 +117,23 @@ def image_pyramid(inputfile, outputdir,
     """
     if renderer is None:
         renderer = PngRenderer()
-    storage = NestedFileStorage(outputdir=outputdir,
-                                renderer=renderer)
-    pyramid = TmsPyramid(inputfile=inputfile,
-                         storage=storage,
-                         min_resolution=min_resolution,
-                         max_resolution=max_resolution)
-    if preprocessor is None:
-        preprocessor = colorize
-    pyramid = preprocessor(**locals())
-    pyramid.slice(fill_borders=fill_borders)
+    with ThreadPoolExecutor(max_workers=cpu_count()) as pool, \
+            NestedFileStorage(outputdir=outputdir,
+                              renderer=renderer,
+                              pool=pool,
+                              hasher=hasher) as storage:
+        pyramid = TmsPyramid(inputfile=inputfile,
+                             storage=storage,
+                             min_resolution=min_resolution,
+                             max_resolution=max_resolution)
+        if preprocessor is None:
+            preprocessor = colorize
+        pyramid = preprocessor(**locals())
+        pyramid.slice(fill_borders=fill_borders)
 
 
 def image_slice(inputfile, outputdir, fill_borders=None,
-                colors=None, renderer=None, preprocessor=None):
+                colors=None, renderer=None, preprocessor=None, hasher=None):
     """
     Slices a GDAL-readable inputfile into PNG tiles.
 
@@ -135,6 +145,7 @@ def image_slice(inputfile, outputdir, fill_borders=None,
                                   10: rgba(255, 255, 255, 255)})
             Defaults to no colorization.
     preprocessor: Function to run on the TmsPyramid before slicing.
+    hasher: Function used to find duplicate tiles. Defaults to intmd5.
 
     Filenames are in the format ``{tms_z}-{tms_x}-{tms_y}-{image_hash}.png``.
 
@@ -143,22 +154,26 @@ def image_slice(inputfile, outputdir, fill_borders=None,
     """
     if renderer is None:
         renderer = PngRenderer()
-    storage = SimpleFileStorage(outputdir=outputdir,
-                                renderer=renderer)
-    pyramid = TmsPyramid(inputfile=inputfile,
-                         storage=storage,
-                         min_resolution=None,
-                         max_resolution=None)
-    if preprocessor is None:
-        preprocessor = colorize
-    pyramid = preprocessor(**locals())
-    pyramid.slice(fill_borders=fill_borders)
+    with ThreadPoolExecutor(max_workers=cpu_count()) as pool, \
+            SimpleFileStorage(outputdir=outputdir,
+                              renderer=renderer,
+                              pool=pool,
+                              hasher=hasher) as storage:
+        pyramid = TmsPyramid(inputfile=inputfile,
+                             storage=storage,
+                             min_resolution=None,
+                             max_resolution=None)
+        if preprocessor is None:
+            preprocessor = colorize
+        pyramid = preprocessor(**locals())
+        pyramid.slice(fill_borders=fill_borders)
 
 
 def warp_mbtiles(inputfile, outputfile, metadata, colors=None, band=None,
                  spatial_ref=None, resampling=None,
                  min_resolution=None, max_resolution=None, fill_borders=None,
-                 zoom_offset=None, renderer=None, pngdata=None):
+                 zoom_offset=None, renderer=None, pngdata=None,
+                 hasher=None):
     """
     Warps a GDAL-readable inputfile into a pyramid of PNG tiles.
 
@@ -174,6 +189,7 @@ def warp_mbtiles(inputfile, outputfile, metadata, colors=None, band=None,
                  Web Mercator
     resampling: Resampling algorithm. Defaults to GDAL's default,
                 nearest neighbour as of GDAL 1.9.1.
+    hasher: Function used to find duplicate tiles. Defaults to intmd5.
 
     min_resolution: Minimum resolution to downsample tiles.
     max_resolution: Maximum resolution to upsample tiles.
@@ -208,13 +224,14 @@ def warp_mbtiles(inputfile, outputfile, metadata, colors=None, band=None,
                              preprocessor=preprocessor,
                              fill_borders=fill_borders,
                              zoom_offset=zoom_offset,
-                             pngdata=pngdata)
+                             pngdata=pngdata,
+                             hasher=hasher)
 
 
 def warp_pyramid(inputfile, outputdir, colors=None, band=None,
                  spatial_ref=None, resampling=None,
                  min_resolution=None, max_resolution=None, fill_borders=None,
-                 renderer=None):
+                 renderer=None, hasher=None):
     """
     Warps a GDAL-readable inputfile into a pyramid of PNG tiles.
 
@@ -230,6 +247,7 @@ def warp_pyramid(inputfile, outputdir, colors=None, band=None,
                  Web Mercator
     resampling: Resampling algorithm. Defaults to GDAL's default,
                 nearest neighbour as of GDAL 1.9.1.
+    hasher: Function used to find duplicate tiles. Defaults to intmd5.
 
     min_resolution: Minimum resolution to downsample tiles.
     max_resolution: Maximum resolution to upsample tiles.
@@ -262,12 +280,13 @@ def warp_pyramid(inputfile, outputdir, colors=None, band=None,
                              max_resolution=max_resolution,
                              colors=colors, renderer=renderer,
                              preprocessor=preprocessor,
-                             fill_borders=fill_borders)
+                             fill_borders=fill_borders,
+                             hasher=hasher)
 
 
 def warp_slice(inputfile, outputdir, fill_borders=None, colors=None, band=None,
                spatial_ref=None, resampling=None,
-               renderer=None):
+               renderer=None, hasher=None):
     """
     Warps a GDAL-readable inputfile into a directory of PNG tiles.
 
@@ -284,6 +303,7 @@ def warp_slice(inputfile, outputdir, fill_borders=None, colors=None, band=None,
                  Web Mercator
     resampling: Resampling algorithm. Defaults to GDAL's default,
                 nearest neighbour as of GDAL 1.9.1.
+    hasher: Function used to find duplicate tiles. Defaults to intmd5.
 
     min_resolution: Minimum resolution to downsample tiles.
     max_resolution: Maximum resolution to upsample tiles.
@@ -306,7 +326,8 @@ def warp_slice(inputfile, outputdir, fill_borders=None, colors=None, band=None,
         return image_slice(inputfile=warped, outputdir=outputdir,
                            colors=colors, renderer=renderer,
                            preprocessor=preprocessor,
-                           fill_borders=fill_borders)
+                           fill_borders=fill_borders,
+                           hasher=hasher)
 
 
 # Preprocessors
@@ -60,6 +60,18 @@ COLORING_METHODS = {
 }
 
 
+HASH_METHODS = {
+    'md5': 'intmd5',
+    'sha256': 'intsha256',
+}
+
+
+def hash_arg(s):
+    """Validates --tile-hash"""
+    from gdal2mbtiles import utils
+    return getattr(utils, HASH_METHODS[s])
+
+
 def coloring_arg(s):
     """Validates --coloring"""
     from gdal2mbtiles import vips
@@ -186,6 +198,11 @@ def parse_args(args):
                        metavar='N',
                        help=('Offset zoom level by N to fit unprojected '
                              'images to square maps. Defaults to 0.'))
+    group.add_argument('--tile-hash', default='md5',
+                       choices=HASH_METHODS,
+                       help=('Hash used to find duplicate tiles. sha256 is '
+                             'faster on CPUs with SHA extensions. '
+                             'Defaults to "md5"'))
 
     group = parser.add_argument_group(title='Coloring arguments')
     group.add_argument('--coloring', default=None,
@@ -230,6 +247,9 @@ def parse_args(args):
     # Transform choices into ColorBase classes
     args.coloring = coloring_arg(args.coloring)
 
+    # Transform choices into hash functions
+    args.tile_hash = hash_arg(args.tile_hash)
+
     return args
 
 
@@ -304,7 +324,7 @@ def main(args=None, use_logging=True):
                      max_resolution=args.max_resolution,
                      fill_borders=args.fill_borders,
                      zoom_offset=args.zoom_offset,
-                     pngdata=pngdata,
+                     pngdata=pngdata, hasher=args.tile_hash,
                      # Coloring
                      colors=colors, band=band)
         return 0
@@ -509,9 +509,7 @@ class MBTiles(object):
         hashed: Integer hash of the raw image data, not compressed or encoded.
         data: Compressed and encoded image buffer.
         """
-        # tile_id must be a 64-bit signed integer, but hashing functions
-        # produce unsigned integers.
-        hashed = unpack(b'q', pack(b'Q', hashed & 0xffffffffffffffff))[0]
+        hashed = self.tile_id(hashed)
         with self._conn:
             if data is not None:
                 # Insert tile data into images
@@ -533,6 +531,22 @@ class MBTiles(object):
                 {'x': x, 'y': y, 'z': z, 'hashed': hashed}
             )
 
+    @classmethod
+    def tile_id(cls, hashed):
+        """Returns the tile_id used to store an image hashed as `hashed`."""
+        # tile_id must be a 64-bit signed integer, but hashing functions
+        # produce unsigned integers.
+        return unpack(b'q', pack(b'Q', hashed & 0xffffffffffffffff))[0]
+
+    def tile_ids(self):
+        """Returns the tile_ids of all the images stored."""
+        try:
+            cursor = self._conn.execute('SELECT tile_id FROM images')
+        except sqlite3.OperationalError:
+            # Not written by us, so tiles are not normalized into images.
+            return set()
+        return set(tile_id for tile_id, in cursor)
+
     def get(self, x, y, z):
         """
         Returns the compressed image data at coordinates `x`, `y`, `z`.
@@ -89,10 +89,7 @@ class JpegRenderer(Renderer):
         if image.bands > 3:
             # Strip out alpha channel, otherwise transparent pixels turn white.
             image = image.extract_band(0, n=3)
-        with NamedTemporaryFile(suffix=self.suffix,
-                                dir=self.tempdir) as rendered:
-            image.write_to_file(rendered.name, **self._vips_options)
-            return rendered.read()
+        return image.write_to_buffer('.jpeg', **self._vips_options)
 
 
 class PngRenderer(Renderer):
@@ -107,15 +104,21 @@ class PngRenderer(Renderer):
     optimize: Optimizes PNG using optipng. Default False. See `optipng -h`.
     suffix: Suffix for filename. Default '.png'.
 
-    If optimize is not False, then compression is ignored and set to 0, to
+    If optimize is not False, then compression is ignored and set to 1, to
     prevent double-compression. In general, VIPS compression is faster than
     optimizing with OptiPNG.
+
+    If png8 is not False, VIPS only writes an intermediate PNG for pngquant
+    to re-encode, so it uses INTERMEDIATE_COMPRESSION instead.
     """
     _suffix = '.png'
 
     PNGQUANT = 'pngquant'
     OPTIPNG = 'optipng'
 
+    # zlib level for PNGs that pngquant decodes and re-encodes anyway.
+    INTERMEDIATE_COMPRESSION = 1
+
     def __init__(self, compression=None, interlace=None, png8=None,
                  optimize=None, **kwargs):
         if compression is None:
@@ -161,13 +164,20 @@ class PngRenderer(Renderer):
 
     @property
     def _vips_options(self):
+        compression = self.compression
+        if self.png8 is not False:
+            compression = self.INTERMEDIATE_COMPRESSION
         return {
-            'compression': self.compression,
+            'compression': compression,
             'interlace': self.interlace
         }
 
     def render(self, image):
         """Returns the rendered VIPS `image`."""
+        if self.png8 is False and self.optimize is False:
+            # No external tools need a file, so encode straight to memory.
+            return image.write_to_buffer('.png', **self._vips_options)
+
         with NamedTemporaryFile(suffix=self.suffix,
                                 dir=self.tempdir) as rendered:
             image.write_to_file(rendered.name, **self._vips_options)
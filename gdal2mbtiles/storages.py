@@ -22,10 +22,12 @@ from __future__ import (absolute_import, division, print_function,
 
 import sys
 
-from collections import defaultdict
+from collections import defaultdict, deque
 from functools import partial
 import os
 
+import numpy
+
 from .constants import TILE_SIDE
 from .gdal import SpatialReference
 from .mbtiles import MBTiles
@@ -43,25 +45,141 @@ except NameError:
 class Storage(object):
     """Base class for storages."""
 
-    def __init__(self, renderer, pool=None):
+    # Number of renders that may be queued on the pool before `render`
+    # blocks, which bounds the memory held by pending tiles.
+    MAX_PENDING_RENDERS = 64
+
+    def __init__(self, renderer, pool=None, hasher=None):
         """
         Initialize a storage.
 
         renderer: Used to render images into tiles.
+        pool: concurrent.futures.Executor used to render tiles concurrently.
+              Default None, which renders tiles synchronously. VIPS releases
+              the GIL, so a ThreadPoolExecutor is sufficient.
+        hasher: Function returning an integer digest of raw image data.
+                Default `intmd5`. `intsha256` is faster on CPUs with SHA
+                extensions, but changes the hashes of existing tiles.
         """
         self.renderer = renderer
 
-        self.hasher = intmd5
+        if hasher is None:
+            hasher = intmd5
+        self.hasher = hasher
+
+        self.pool = pool
+        self._pending = deque()
+
+        # Hashes of single-colour images, keyed by pixel value and size.
+        self._uniform_hashes = {}
+
+        # Images from the last call to get_hashes, and their hashes, keyed by
+        # id(image). Holding the images keeps their ids from being reused.
+        self._known_hashes = {}
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
+        if type is None:
+            self.wait()
+        else:
+            # Don't write any more tiles while an exception propagates.
+            self.cancel()
         return
 
+    def render(self, image, callback):
+        """
+        Renders `image` and calls `callback` with the rendered contents.
+
+        If this storage has a pool, `image` is rendered there and `callback`
+        is called later from this thread, in the same order as the calls to
+        `render` and `defer`.
+        """
+        if self.pool is None:
+            callback(self.renderer.render(image))
+            return
+        # Tiles are usually cut from a larger image in memory, which a
+        # pending render would keep alive. Queue a copy of just this tile.
+        image = image.copy_memory()
+        self._pending.append((self.pool.submit(self.renderer.render, image),
+                              callback))
+        while len(self._pending) > self.MAX_PENDING_RENDERS:
+            self._complete()
+
+    def defer(self, callback):
+        """Calls `callback` with None, after any pending renders."""
+        if not self._pending:
+            callback(None)
+            return
+        self._pending.append((None, callback))
+
+    def wait(self):
+        """Waits for all pending renders and calls their callbacks."""
+        while self._pending:
+            self._complete()
+
+    def cancel(self):
+        """Cancels all pending renders, without calling their callbacks."""
+        while self._pending:
+            future, callback = self._pending.popleft()
+            if future is not None:
+                future.cancel()
+
+    def _complete(self):
+        future, callback = self._pending.popleft()
+        callback(None if future is None else future.result())
+
     def get_hash(self, image):
         """Returns the image content hash."""
-        return self.hasher(image.write_to_memory())
+        known = self._known_hashes.get(id(image))
+        if known is not None and known[0] is image:
+            return known[1]
+
+        data = image.write_to_memory()
+
+        # Most tiles in a pyramid are a single colour, like borders or
+        # oceans. Checking for that is much cheaper than hashing, so only
+        # hash each distinct single-colour image once. The result is the
+        # same as hashing the whole image.
+        pixels = image.width * image.height
+        pixel_size = len(data) // pixels
+        values = numpy.frombuffer(data, dtype=numpy.uint8)
+        first = values[:pixel_size].tobytes()
+
+        # Most other tiles differ at their first, middle or last pixel, so
+        # only compare every pixel when those match.
+        middle = (pixels // 2) * pixel_size
+        if (values[middle:middle + pixel_size].tobytes() != first or
+                values[-pixel_size:].tobytes() != first or
+                not (values[pixel_size:] == values[:-pixel_size]).all()):
+            return self.hasher(data)
+
+        key = (first, len(data))
+        hashed = self._uniform_hashes.get(key)
+        if hashed is None:
+            hashed = self._uniform_hashes[key] = self.hasher(data)
+        return hashed
+
+    def get_hashes(self, images):
+        """
+        Returns the content hashes of `images`, in order.
+
+        If this storage has a pool, the images are hashed concurrently.
+        hashlib releases the GIL while hashing large buffers.
+
+        The hashes are remembered until the next call, so that `get_hash`,
+        and therefore `save`, doesn't hash these images again.
+        """
+        if self.pool is None:
+            hashes = [self.get_hash(image) for image in images]
+        else:
+            hashes = list(self.pool.map(self.get_hash, images))
+        self._known_hashes = dict(
+            (id(image), (image, hashed))
+            for image, hashed in zip(images, hashes)
+        )
+        return hashes
 
     def filepath(self, x, y, z, hashed):
         """Returns the filepath."""
@@ -99,7 +217,7 @@ class SimpleFileStorage(Storage):
 
         renderer: Used to render images into tiles.
         outputdir: Output directory for tiles
-        pool: Process pool to coordinate subprocesses.
+        pool: Executor used to render tiles concurrently.
         """
         super(SimpleFileStorage, self).__init__(renderer=renderer,
                                                 **kwargs)
@@ -108,34 +226,72 @@ class SimpleFileStorage(Storage):
         self.seen = seen
         self._border_hashed = None
 
+        # File descriptor for self.outputdir, opened by `symlink`.
+        self._outputdir_fd = None
+
         self.outputdir = outputdir
         makedirs(self.outputdir, ignore_exists=True)
 
+    def __del__(self):
+        self._close_outputdir()
+
+    def __exit__(self, type, value, traceback):
+        try:
+            super(SimpleFileStorage, self).__exit__(type, value, traceback)
+        finally:
+            self._close_outputdir()
+
+    def _close_outputdir(self):
+        if self._outputdir_fd is not None:
+            os.close(self._outputdir_fd)
+            self._outputdir_fd = None
+
     def filepath(self, x, y, z, hashed):
         """Returns the filepath, relative to self.outputdir."""
-        return ('{z}-{x}-{y}-{hashed:x}'.format(**locals()) +
-                self.renderer.suffix)
+        return '{0}-{1}-{2}-{3:x}{4}'.format(z, x, y, hashed,
+                                             self.renderer.suffix)
 
     def save(self, x, y, z, image):
         """Saves `image` at coordinates `x`, `y`, and `z`."""
         hashed = self.get_hash(image)
         filepath = self.filepath(x=x, y=y, z=z, hashed=hashed)
-        if hashed in self.seen:
-            self.symlink(src=self.seen[hashed], dst=filepath)
+        # Looks up and records the tile in one step. Only a new tile gets our
+        # filepath back.
+        existing = self.seen.setdefault(hashed, filepath)
+        if existing is not filepath:
+            self.symlink(src=existing, dst=filepath)
         else:
-            self.seen[hashed] = filepath
-            contents = self.renderer.render(image)
-            outputfile = os.path.join(self.outputdir, filepath)
-            with open(outputfile, 'wb') as output:
-                output.write(contents)
+            self.render(image, partial(self._write, filepath))
+
+    def _write(self, filepath, contents):
+        """Writes rendered `contents` to `filepath`."""
+        outputfile = os.path.join(self.outputdir, filepath)
+        with open(outputfile, 'wb') as output:
+            output.write(contents)
 
     def symlink(self, src, dst):
         """Creates a relative symlink from dst to src."""
-        absdst = os.path.join(self.outputdir, dst)
-        abssrc = os.path.join(self.outputdir, src)
-        srcpath = os.path.relpath(abssrc,
-                                  start=os.path.dirname(absdst))
-        os.symlink(srcpath, absdst)
+        srcdir, srcname = os.path.split(src)
+        if srcdir == os.path.dirname(dst):
+            # Same directory, so the link is just the name.
+            srcpath = srcname
+        else:
+            absdst = os.path.join(self.outputdir, dst)
+            abssrc = os.path.join(self.outputdir, src)
+            srcpath = os.path.relpath(abssrc,
+                                      start=os.path.dirname(absdst))
+
+        if os.symlink not in os.supports_dir_fd:
+            os.symlink(srcpath, os.path.join(self.outputdir, dst))
+            return
+
+        # Create dst relative to outputdir, without walking its path again
+        # for every symlink.
+        if self._outputdir_fd is None:
+            self._outputdir_fd = os.open(
+                self.outputdir, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+            )
+        os.symlink(srcpath, dst, dir_fd=self._outputdir_fd)
 
     def save_border(self, x, y, z):
         """Saves a border image at coordinates `x`, `y`, and `z`."""
@@ -160,7 +316,7 @@ class NestedFileStorage(SimpleFileStorage):
 
         renderer: Used to render images into tiles.
         outputdir: Output directory for tiles
-        pool: Process pool to coordinate subprocesses.
+        pool: Executor used to render tiles concurrently.
         """
         super(NestedFileStorage, self).__init__(renderer=renderer,
                                                 **kwargs)
@@ -168,8 +324,8 @@ class NestedFileStorage(SimpleFileStorage):
 
     def filepath(self, x, y, z, hashed):
         """Returns the filepath, relative to self.outputdir."""
-        return (os.path.join(str(z), str(x), str(y)) +
-                self.renderer.suffix)
+        return '{0}{sep}{1}{sep}{2}{3}'.format(z, x, y, self.renderer.suffix,
+                                               sep=os.path.sep)
 
     def makedirs(self, x, y, z):
         if not self.madedirs[z][x]:
@@ -195,13 +351,17 @@ class MbtilesStorage(Storage):
     http://mapbox.com/developers/mbtiles/
     """
     def __init__(self, renderer, filename, zoom_offset=None, seen=None,
-                 **kwargs):
+                 reuse_images=False, **kwargs):
         """
         Initializes storage.
 
         renderer: Used to render images into tiles.
         filename: Name of the MBTiles file.
-        pool: Process pool to coordinate subprocesses.
+        pool: Executor used to render tiles concurrently.
+        seen: Set of image hashes already stored.
+        reuse_images: Don't render images again that are already stored in
+                      `filename`. Only safe if they were rendered by an
+                      equivalent renderer. Default False.
         """
         super(MbtilesStorage, self).__init__(renderer=renderer,
                                              **kwargs)
@@ -209,9 +369,6 @@ class MbtilesStorage(Storage):
             zoom_offset = 0
         self.zoom_offset = zoom_offset
 
-        if seen is None:
-            seen = set()
-        self.seen = seen
         self._border_hashed = None
 
         self.mbtiles = None
@@ -223,13 +380,32 @@ class MbtilesStorage(Storage):
             self.mbtiles = filename
             self.filename = self.mbtiles.filename
 
+        if seen is None:
+            seen = set()
+        self.seen = seen
+
+        self.reuse_images = reuse_images
+        # tile_ids of the images already in self.mbtiles, read on first use.
+        self._stored_tile_ids = None
+
     def __del__(self):
         if self.mbtiles is not None:
             self.mbtiles.close()
 
+    def is_stored(self, hashed):
+        """Returns whether `reuse_images` applies to the image `hashed`."""
+        if not self.reuse_images:
+            return False
+        if self._stored_tile_ids is None:
+            self._stored_tile_ids = self.mbtiles.tile_ids()
+        return MBTiles.tile_id(hashed) in self._stored_tile_ids
+
     def __exit__(self, type, value, traceback):
-        if self.mbtiles is not None:
-            self.mbtiles.close()
+        try:
+            super(MbtilesStorage, self).__exit__(type, value, traceback)
+        finally:
+            if self.mbtiles is not None:
+                self.mbtiles.close()
 
     @classmethod
     def create(cls, renderer, filename, metadata, zoom_offset=None,
@@ -243,7 +419,7 @@ class MbtilesStorage(Storage):
         zoom_offset: Offset zoom level.
 
         version: Optional MBTiles version.
-        pool: Process pool to coordinate subprocesses.
+        pool: Executor used to render tiles concurrently.
 
         Metadata is also taken as **kwargs. See `mbtiles.Metadata`.
         """
@@ -273,21 +449,26 @@ class MbtilesStorage(Storage):
     def save(self, x, y, z, image):
         """Saves `image` at coordinates `x`, `y`, and `z`."""
         hashed = self.get_hash(image)
-        if hashed in self.seen:
-            self.mbtiles.insert(x=x, y=y,
-                                z=z + self.zoom_offset,
-                                hashed=hashed)
+        insert = partial(self._insert, x=x, y=y, z=z, hashed=hashed)
+        if hashed in self.seen or self.is_stored(hashed):
+            # Keep inserts in order with any pending renders
+            self.defer(insert)
         else:
-            self.seen.add(hashed)
-            contents = self.renderer.render(image)
+            self.render(image, insert)
+        self.seen.add(hashed)
+
+    def _insert(self, contents, x, y, z, hashed):
+        """Inserts rendered `contents` at coordinates `x`, `y`, and `z`."""
+        data = None
+        if contents is not None:
             if sys.version_info < (3, 0):
                 data = buffer(contents)
             else:
                 data = memoryview(contents)
-            self.mbtiles.insert(x=x, y=y,
-                                z=z + self.zoom_offset,
-                                hashed=hashed,
-                                data=data)
+        self.mbtiles.insert(x=x, y=y,
+                            z=z + self.zoom_offset,
+                            hashed=hashed,
+                            data=data)
 
     def save_border(self, x, y, z):
         """Saves a border image at coordinates `x`, `y`, and `z`."""
@@ -297,6 +478,5 @@ class MbtilesStorage(Storage):
             self._border_hashed = self.get_hash(image)
         else:
             # self._border_hashed will already be inserted
-            self.mbtiles.insert(x=x, y=y,
-                                z=z + self.zoom_offset,
-                                hashed=self._border_hashed)
+            self.defer(partial(self._insert, x=x, y=y, z=z,
+                               hashed=self._border_hashed))
@@ -22,7 +22,7 @@ from __future__ import (absolute_import, division, print_function,
 
 from contextlib import contextmanager
 import errno
-from hashlib import md5
+from hashlib import md5, sha256
 import os
 from shutil import rmtree
 from tempfile import mkdtemp
@@ -81,3 +81,8 @@ def recursive_listdir(directory):
 def intmd5(x):
     """Returns the MD5 digest of `x` as an integer."""
     return int(md5(x).hexdigest(), base=16)
+
+
+def intsha256(x):
+    """Returns the SHA-256 digest of `x` as an integer."""
+    return int(sha256(x).hexdigest(), base=16)
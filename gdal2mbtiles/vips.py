@@ -20,8 +20,6 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
-import os
-
 from contextlib import contextmanager
 from ctypes import c_double, c_int, c_void_p, cdll
 from ctypes.util import find_library
@@ -142,41 +140,35 @@ class VImageAdapter(object):
         BandFormat.DPCOMPLEX: numpy.complex128,
     }
 
-    def __init__(self, image, *args, **kwargs):
+    # Adapters are created for every image operation, so only check the VIPS
+    # concurrency the first time.
+    _concurrency_checked = False
+
+    def __init__(self, image):
         # image: a pyvips.Image object
         self.image = image
-        if VIPS.get_concurrency() == 0:
-            # Override auto-detection from environ and argv.
-            VIPS.set_concurrency(processes=cpu_count())
-        args = [a.encode('utf-8') if isinstance(a, str) else a
-                for a in args]
-        with TIFF.disable_warnings():
-            super(VImageAdapter, self).__init__(*args, **kwargs)
+        if not VImageAdapter._concurrency_checked:
+            if VIPS.get_concurrency() == 0:
+                # Override auto-detection from environ and argv.
+                VIPS.set_concurrency(processes=cpu_count())
+            VImageAdapter._concurrency_checked = True
 
     @classmethod
     def new_rgba(cls, width, height, ink=None):
-        """Creates a new transparent RGBA image sized width × height."""
-        # Creating a placeholder image with new_from_memory (equivalent of the
-        # old vipsCC frombuffer) creates an image
-        # which is a few byes different when written back to memory, which means
-        # we can't store and retrieve it from its hash.  So instead we use a
-        # temporary transparent 256x256 file for the initial image
-        image = Image.new_from_file(
-            os.path.join(
-                os.path.dirname(os.path.realpath(__file__)), 'default_rgba.png'
-            )
-        )
-        image = image.copy(
-            width=width, height=height,
-            coding='none',  # No coding and no compression
+        """
+        Creates a new RGBA image sized width × height, filled with `ink`.
+
+        ink: rgba colour. Defaults to transparent black.
+        """
+        # VIPS generates these pixels on demand, so nothing is allocated
+        # until the image is actually used.
+        image = Image.black(width, height, bands=4).copy(
             interpretation='srgb',
             xres=2.835, yres=2.835,  # Arbitrary 600 dpi
-            xoffset=0, yoffset=0  # Working buffer
         )
         if ink is not None:
-            image.draw_rect(
-                [ink.r, ink.g, ink.b, ink.a], 0, 0, width, height, fill=True
-            )
+            # A constant image with the same format and metadata
+            image = image.new_from_image([ink.r, ink.g, ink.b, ink.a])
         return image
 
     @classmethod
@@ -299,12 +291,13 @@ class VImageAdapter(object):
         #     (-.5,-.5), (-.5,M-.5), (N-.5,-.5) and (N-.5,M-.5).
 
         if output_size is None:
+            width, height = self.image.width, self.image.height
             if XY(x=xscale, y=yscale) > XY(x=1.0, y=1.0):
-                output_width = int(ceil(self.image.width * xscale))
-                output_height = int(ceil(self.image.height * yscale))
+                output_width = int(ceil(width * xscale))
+                output_height = int(ceil(height * yscale))
             else:
-                output_width = int(floor(self.image.width * xscale))
-                output_height = int(floor(self.image.height * yscale))
+                output_width = int(floor(width * xscale))
+                output_height = int(floor(height * yscale))
         else:
             output_width, output_height = output_size
 
@@ -361,10 +354,52 @@ class VImageAdapter(object):
             xscale=xscale, yscale=yscale, output_size=output_size, interpolate='bilinear'
         )
 
+    def shrink(self, xscale, yscale):
+        """
+        Returns a new pyvips.Image that has been shrunk by `xscale` and `yscale`.
+
+        When both scales are whole fractions, like 0.5, this uses the VIPS box
+        filter, which is much faster. Other scales fall back to shrink_affine.
+
+        The box filter averages every pixel in each block. When halving, these
+        are the same 2x2 blocks that shrink_affine interpolates, but VIPS
+        rounds after each direction, so pixels may differ by 1. Smaller scales
+        average more pixels than shrink_affine, which samples only the middle
+        of each block.
+
+        xscale: floating point scaling value for image
+        yscale: floating point scaling value for image
+        """
+        if not 0.0 < xscale <= 1.0:
+            raise ValueError(
+                'xscale {0!r} be between 0.0 and 1.0'.format(xscale)
+            )
+        if not 0.0 < yscale <= 1.0:
+            raise ValueError(
+                'yscale {0!r} be between 0.0 and 1.0'.format(yscale)
+            )
+
+        xshrink, yshrink = 1 / xscale, 1 / yscale
+        if xshrink != int(xshrink) or yshrink != int(yshrink):
+            return self.shrink_affine(xscale=xscale, yscale=yscale)
+
+        width = int(floor(self.image.width * xscale))
+        height = int(floor(self.image.height * yscale))
+        image = self.image.shrink(xshrink, yshrink)
+        if image.width != width or image.height != height:
+            # Newer versions of VIPS keep partial blocks at the right and
+            # bottom edges, which shrink_affine drops.
+            image = image.extract_area(0, 0, width, height)
+        return image
+
     def stretch(self, xscale, yscale, output_size=None):
         """
         Returns a new pyvips.Image that has been stretched by `xscale` and `yscale`.
 
+        Stretching uses nearest neighbour interpolation, so whole-number
+        scales just replicate pixels, which VIPS's zoom does much faster than
+        affine.
+
         xscale: floating point scaling value for image
         yscale: floating point scaling value for image
         output_size: output width and height in pixels (tuple)
@@ -377,6 +412,9 @@ class VImageAdapter(object):
             raise ValueError(
                 'yscale {0!r} cannot be less than 1.0'.format(yscale)
             )
+        if (output_size is None and
+                xscale == int(xscale) and yscale == int(yscale)):
+            return self.image.zoom(int(xscale), int(yscale))
         return self._scale(
             xscale=xscale, yscale=yscale, output_size=output_size,
             interpolate='near'
@@ -392,23 +430,31 @@ class VImageAdapter(object):
 
         returns a new Image object
         """
+        # Each dimension lookup is a call into libvips, so only do it once.
+        image_width, image_height = self.image.width, self.image.height
+
         # Pixel offset from top-left of the aligned image.
         #
         # The y value needs to be converted from the lower-left corner to the
         # top-left corner.
         x = int(round(offset.x * tile_width)) % tile_width
-        y = int(round(self.image.height - offset.y * tile_height)) % tile_height
+        y = int(round(image_height - offset.y * tile_height)) % tile_height
 
         # Number of tiles for the aligned image, rounded up to provide
         # right and bottom borders.
-        tiles_x = ceil((self.image.width + x / 2) / tile_width)
-        tiles_y = ceil((self.image.height + y / 2) / tile_height)
+        #
+        # This is ceil((image_width + x / 2) / tile_width), with both sides
+        # of the fraction doubled so that it stays in integer arithmetic.
+        tiles_x = ((2 * image_width + x + 2 * tile_width - 1) //
+                   (2 * tile_width))
+        tiles_y = ((2 * image_height + y + 2 * tile_height - 1) //
+                   (2 * tile_height))
 
         # Pixel width and height for the aligned image.
-        width = int(tiles_x * tile_width)
-        height = int(tiles_y * tile_height)
+        width = tiles_x * tile_width
+        height = tiles_y * tile_height
 
-        if width == self.image.width and height == self.image.height:
+        if width == image_width and height == image_height:
             # No change
             assert x == y == 0
             return self.image
@@ -427,10 +473,9 @@ class VImageAdapter(object):
         """Return an instance of the NumPy data type."""
         return self.NUMPY_TYPES[self.image.format]()
 
-    def write(self, *args):
-        args = [a.encode('utf-8') if isinstance(a, str) else a
-                for a in args]
-        return self.image.write(*args)
+    def write(self, other):
+        """Writes this image to the pyvips.Image `other`."""
+        return self.image.write(other)
 
 
 class VipsBand(Band):
@@ -495,7 +540,8 @@ class VipsBand(Band):
 class VipsDataset(Dataset):
     def __init__(self, inputfile, *args, **kwargs):
         """
-        Opens a GDAL-readable file and holds a VImage for scaling and aligning.
+        Opens a GDAL-readable file and holds a pyvips.Image for scaling and
+        aligning.
         """
         super(VipsDataset, self).__init__(inputfile, *args, **kwargs)
 
@@ -727,7 +773,7 @@ class TmsTiles(object):
     def __init__(self, image, storage, tile_width, tile_height, offset,
                  resolution):
         """
-        image: gdal2mbtiles.vips.VImage
+        image: pyvips.Image
         storage: Storage for rendered tiles
         tile_width: Number of pixels for each tile
         tile_height: Number of pixels for each tile
@@ -744,15 +790,19 @@ class TmsTiles(object):
         # Used to determine whether this TmsTiles is backed by a buffer.
         self._parent = None
 
+        # self.image is never replaced, so its dimensions never change.
+        self._image_width = image.width
+        self._image_height = image.height
+
     @property
     def image_width(self):
         """Returns the width of self.image in pixels."""
-        return self.image.width
+        return self._image_width
 
     @property
     def image_height(self):
         """Returns the height of self.image in pixels."""
-        return self.image.height
+        return self._image_height
 
     def fill_borders(self, borders, resolution):
         for x, y in borders:
@@ -760,23 +810,53 @@ class TmsTiles(object):
 
     def _slice(self):
         """Helper function that actually slices tiles. See ``slice``."""
+        # Hoisted out of the loop, which runs once per tile.
+        image = self.image
+        image_width, image_height = self.image_width, self.image_height
+        tile_width, tile_height = self.tile_width, self.tile_height
+        resolution = self.resolution
+        get_hashes = self.storage.get_hashes
+        save = self.storage.save
+
+        # Pixel offsets of every column and row of tiles, paired with their
+        # TMS offsets. Pixel offsets are multiples of the tile size, so
+        # integer division is exact.
+        xs = numpy.arange(0, image_width, tile_width)
+        ys = numpy.arange(0, image_height, tile_height)
+        columns = list(zip(
+            xs.tolist(),
+            (xs // tile_width + int(self.offset.x)).tolist()
+        ))
+        rows = zip(
+            ys.tolist(),
+            ((image_height - ys) // tile_height +
+             int(self.offset.y) - 1).tolist()
+        )
+
         with LibVips.disable_warnings():
-            xys = []
-            for y in range(0, self.image_height, self.tile_height):
-                for x in range(0, self.image_width, self.tile_width):
-                    out = self.image.extract_area(
-                        x, y,                    # left, top offsets
-                        self.tile_width, self.tile_height
+            for y, tms_y in rows:
+                # Render a whole row of tiles in a single pass, so that VIPS
+                # walks the pipeline once with all its threads, instead of
+                # once for every tile.
+                row = image.extract_area(
+                    0, y,                        # left, top offsets
+                    image_width, tile_height
+                ).copy_memory()
+                tiles = [
+                    row.extract_area(
+                        x, 0,                    # left, top offsets
+                        tile_width, tile_height
                     )
-                    offset = XY(
-                        x=int(x / self.tile_width + self.offset.x),
-                        y=int((self.image_height - y) / self.tile_height +
-                              self.offset.y - 1)
-                    )
-                    xys.append((x, y))
-                    self.storage.save(x=offset.x, y=offset.y,
-                                      z=self.resolution,
-                                      image=out)
+                    for x, tms_x in columns
+                ]
+
+                # Hash the whole row at once, so that it can be spread over
+                # the storage's pool. The storage remembers these hashes, so
+                # save doesn't compute them again.
+                get_hashes(tiles)
+
+                for (x, tms_x), out in zip(columns, tiles):
+                    save(x=tms_x, y=tms_y, z=resolution, image=out)
 
     def slice(self):
         """
@@ -819,7 +899,7 @@ class TmsTiles(object):
 
         for res in reversed(list(range(self.resolution - levels, self.resolution))):
             offset /= 2.0
-            shrunk = VImageAdapter(image).shrink_affine(xscale=0.5, yscale=0.5)
+            shrunk = VImageAdapter(image).shrink(xscale=0.5, yscale=0.5)
             image = VImageAdapter(shrunk).tms_align(tile_width=self.tile_width,
                                      tile_height=self.tile_height,
                                      offset=offset)
@@ -891,9 +971,11 @@ class TmsTiles(object):
             logger.debug(
                 'Buffering resolution {0} to disk'.format(resolution)
             )
+            # Unlike vipsCC, pyvips writes into the temporary image in place
+            # and returns None.
             vipsfile = Image.new_temp_file("%s.v")
-            tempfile_image = image.write(vipsfile)
-            return tempfile_image
+            image.write(vipsfile)
+            return vipsfile
 
         logger.debug(
             'Buffering resolution {0} to memory'.format(resolution)
@@ -958,8 +1040,18 @@ class TmsPyramid(object):
     def get_tiles(self):
         """Returns the TmsTiles object for the native resolution."""
         offset = self.dataset.GetTmsExtents()
+        image = self.image
+        if (VImageAdapter(image).BufferSize() <
+                self.TmsTiles.IMAGE_BUFFER_DISK_THRESHOLD):
+            # Every resolution is computed from the native image, which VIPS
+            # would otherwise decode (and colorize) again from the inputfile
+            # for each of them. Keep its pixels in memory once computed.
+            image = image.tilecache(tile_width=TILE_SIDE,
+                                    tile_height=TILE_SIDE,
+                                    max_tiles=-1, threaded=True,
+                                    persistent=True)
         with LibVips.disable_warnings():
-            return self.TmsTiles(image=self.image,
+            return self.TmsTiles(image=image,
                                  storage=self.storage,
                                  tile_width=TILE_SIDE, tile_height=TILE_SIDE,
                                  offset=offset.lower_left,
@@ -1075,6 +1167,9 @@ class TmsPyramid(object):
                                 max_resolution=max_resolution,
                                 fill_borders=fill_borders)
 
+        # Wait for tiles still being rendered by the storage's pool
+        self.storage.wait()
+
         # Post-import hook needs to be called in case the storage has to
         # update some metadata
         self.storage.post_import(pyramid=self)
@@ -1197,7 +1292,7 @@ class ColorBase(dict):
                                        global_dict={})
 
     def colorize(self, image, nodata=None):
-        """Returns a new RGBA VImage that has been colorized"""
+        """Returns a new RGBA pyvips.Image that has been colorized"""
         if image.bands != 1:
             raise ValueError(
                 'image {0!r} has more than one band'.format(image)
@@ -1217,7 +1312,7 @@ class ColorBase(dict):
         # Use numexpr to color the data as RGBA bands
         bands = self._colorize_bands(data=data, nodata=nodata)
 
-        # Merge the bands into a single RGBA VImage
+        # Merge the bands into a single RGBA pyvips.Image
         images = [VImageAdapter.from_numpy_array(
             array=band, width=image.width, height=image.height, bands=1,
             format='uchar'
@@ -203,6 +203,28 @@ class TestGdal2mbtilesScript(unittest.TestCase):
                 cursor = mbtiles._conn.execute('SELECT COUNT(*) FROM tiles')
                 self.assertTrue(cursor.fetchone(), [4])
 
+    def test_tile_hash(self):
+        null = open('/dev/null', 'r+')
+
+        with NamedTemporaryFile(suffix='.mbtiles') as output:
+            # Valid
+            command = [sys.executable, self.script,
+                       '--tile-hash', 'sha256',
+                       self.inputfile, output.name]
+            check_call(command, env=self.environ)
+            with MBTiles(output.name) as mbtiles:
+                cursor = mbtiles._conn.execute('SELECT COUNT(*) FROM tiles')
+                self.assertEqual(cursor.fetchone(), (1,))
+
+            # Unknown hash
+            command = [sys.executable, self.script,
+                       '--tile-hash', 'crc32',
+                       self.inputfile, output.name]
+            self.assertRaises(
+                CalledProcessError,
+                check_call, command, env=self.environ, stderr=null
+            )
+
     def test_colors(self):
         null = open('/dev/null', 'r+')
 
@@ -3,18 +3,23 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+from concurrent.futures import ThreadPoolExecutor
 import errno
 import os
 from shutil import rmtree
 from tempfile import NamedTemporaryFile
 import unittest
 
+import numpy
+from pyvips.enums import BandFormat
+
 from gdal2mbtiles.mbtiles import Metadata
 from gdal2mbtiles.renderers import PngRenderer, TouchRenderer
 from gdal2mbtiles.storages import (MbtilesStorage,
                                    NestedFileStorage, SimpleFileStorage)
 from gdal2mbtiles.gd_types import rgba
-from gdal2mbtiles.utils import intmd5, NamedTemporaryDir, recursive_listdir
+from gdal2mbtiles.utils import (intmd5, intsha256, NamedTemporaryDir,
+                                recursive_listdir)
 from gdal2mbtiles.vips import VImageAdapter
 
 
@@ -53,6 +58,55 @@ class TestSimpleFileStorage(unittest.TestCase):
         self.assertEqual(self.storage.get_hash(image=image),
                          int('f1d3ff8443297732862df21dc4e57262', base=16))
 
+    def test_get_hash_uniform(self):
+        # Single-colour images are hashed once, but must still hash the same
+        # as their contents.
+        for width, height in [(1, 1), (2, 2), (2, 2), (3, 1)]:
+            image = VImageAdapter.new_rgba(width=width, height=height,
+                                           ink=rgba(r=0, g=0, b=0, a=0))
+            self.assertEqual(self.storage.get_hash(image=image),
+                             intmd5(bytes(width * height * 4)))
+
+    def test_get_hash_mixed(self):
+        # Tiles that only differ away from the sampled pixels
+        data = bytes([0, 0, 0, 0, 1, 1, 1, 1] * 2 + [0, 0, 0, 0])
+        image = VImageAdapter.from_numpy_array(
+            array=numpy.frombuffer(data, dtype=numpy.uint8),
+            width=5, height=1, bands=4, format=BandFormat.UCHAR
+        )
+        self.assertEqual(self.storage.get_hash(image=image), intmd5(data))
+
+    def test_get_hashes(self):
+        images = [VImageAdapter.new_rgba(width=width, height=1,
+                                         ink=rgba(r=0, g=0, b=0, a=0))
+                  for width in range(1, 5)]
+        expected = [self.storage.get_hash(image=image) for image in images]
+        self.assertEqual(self.storage.get_hashes(images=images), expected)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            storage = SimpleFileStorage(outputdir=self.outputdir,
+                                        renderer=self.renderer,
+                                        pool=pool)
+            self.assertEqual(storage.get_hashes(images=images), expected)
+
+        # get_hash reuses the hashes from get_hashes
+        def hasher(data):
+            raise AssertionError('hashed again')
+        storage.hasher = hasher
+        self.assertEqual([storage.get_hash(image=image) for image in images],
+                         expected)
+
+    def test_get_hash_sha256(self):
+        storage = SimpleFileStorage(outputdir=self.outputdir,
+                                    renderer=self.renderer,
+                                    hasher=intsha256)
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                ink=rgba(r=0, g=0, b=0, a=0))
+        self.assertEqual(
+            storage.get_hash(image=image),
+            int('df3f619804a92fdb4057192dc43dd748'
+                'ea778adc52bc498ce80524c014b81119', base=16)
+        )
+
     def test_save(self):
         image = VImageAdapter.new_rgba(width=1, height=1,
                                 ink=rgba(r=0, g=0, b=0, a=0))
@@ -79,6 +133,47 @@ class TestSimpleFileStorage(unittest.TestCase):
             '2-0-1-f1d3ff8443297732862df21dc4e57262.png'
         )
 
+    def test_save_pool(self):
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                ink=rgba(r=0, g=0, b=0, a=0))
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            storage = SimpleFileStorage(outputdir=self.outputdir,
+                                        renderer=self.renderer,
+                                        pool=pool)
+            storage.save(x=0, y=1, z=2, image=image)
+            storage.save(x=1, y=0, z=2, image=image)
+            storage.wait()
+        self.assertEqual(set(os.listdir(self.outputdir)),
+                         set([
+                             '2-0-1-f1d3ff8443297732862df21dc4e57262.png',
+                             '2-1-0-f1d3ff8443297732862df21dc4e57262.png'
+                         ]))
+        self.assertFalse(
+            os.path.islink(os.path.join(
+                self.outputdir, '2-0-1-f1d3ff8443297732862df21dc4e57262.png'
+            ))
+        )
+        self.assertTrue(
+            os.path.islink(os.path.join(
+                self.outputdir, '2-1-0-f1d3ff8443297732862df21dc4e57262.png'
+            ))
+        )
+
+    def test_save_pool_exception(self):
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                ink=rgba(r=0, g=0, b=0, a=0))
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            try:
+                with SimpleFileStorage(outputdir=self.outputdir,
+                                       renderer=self.renderer,
+                                       pool=pool) as storage:
+                    storage.save(x=0, y=1, z=2, image=image)
+                    raise ValueError()
+            except ValueError:
+                pass
+        # Pending renders are dropped, instead of written out.
+        self.assertEqual(os.listdir(self.outputdir), [])
+
     def test_symlink(self):
         # Same directory
         src = 'source'
@@ -328,6 +423,45 @@ class TestMbtilesStorage(unittest.TestCase):
             ]
         )
 
+    def test_save_existing(self):
+        # We must create this on disk
+        self.storage = MbtilesStorage.create(renderer=self.renderer,
+                                             filename=self.tempfile.name,
+                                             metadata=self.metadata)
+
+        # Transparent 1×1 image
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                ink=rgba(r=0, g=0, b=0, a=0))
+        self.storage.save(x=0, y=1, z=2, image=image)
+        self.storage.mbtiles.close()
+
+        # Re-open the created file, which already contains the image
+        storage = MbtilesStorage(renderer=TouchRenderer(suffix='.png'),
+                                 filename=self.tempfile.name,
+                                 reuse_images=True)
+        storage.save(x=1, y=0, z=3, image=image)
+        self.assertEqual(len(storage.seen), 1)
+        # The stored image was reused, not rendered by TouchRenderer
+        self.assertEqual(
+            [(z, x, y, intmd5(data))
+             for z, x, y, data in storage.mbtiles.all()],
+            [
+                (2, 0, 1, 89446660811628514001822794642426893173),
+                (3, 1, 0, 89446660811628514001822794642426893173),
+            ]
+        )
+        storage.mbtiles.close()
+
+        # Without reuse_images, the image is rendered again
+        storage = MbtilesStorage(renderer=TouchRenderer(suffix='.png'),
+                                 filename=self.tempfile.name)
+        self.assertEqual(storage.seen, set())
+        storage.save(x=1, y=0, z=3, image=image)
+        self.assertEqual(
+            [(z, x, y, data) for z, x, y, data in storage.mbtiles.all()],
+            [(2, 0, 1, b''), (3, 1, 0, b'')]
+        )
+
     def test_save_border(self):
         # Western hemisphere is border
         self.storage.save_border(x=0, y=0, z=1)
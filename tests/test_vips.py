@@ -7,6 +7,7 @@ import os
 import unittest
 
 import numpy
+from pyvips.enums import BandFormat
 
 from gdal2mbtiles.constants import TILE_SIDE
 from gdal2mbtiles.gdal import Dataset
@@ -44,6 +45,12 @@ class TestVImageAdapter(unittest.TestCase):
         self.assertEqual(image.width, 1)
         self.assertEqual(image.height, 2)
         self.assertEqual(image.bands, 4)
+        self.assertEqual(bytes(image.write_to_memory()), bytes(8))
+
+        image = VImageAdapter.new_rgba(width=2, height=1,
+                                       ink=rgba(r=1, g=2, b=3, a=4))
+        self.assertEqual(bytes(image.write_to_memory()),
+                         bytes([1, 2, 3, 4, 1, 2, 3, 4]))
 
     def test_buffer_size(self):
         image = VImageAdapter.new_rgba(width=16, height=16)
@@ -83,12 +90,39 @@ class TestVImageAdapter(unittest.TestCase):
         self.assertEqual(stretched.width, image.width * 3.0)
         self.assertEqual(stretched.height, image.height * 5.0)
 
+        # Not a whole number
+        stretched = VImageAdapter(image).stretch(xscale=1.5, yscale=2.5)
+        self.assertEqual(stretched.width, image.width * 1.5)
+        self.assertEqual(stretched.height, image.height * 2.5)
+
         # Out of bounds
         self.assertRaises(ValueError,
                           VImageAdapter(image).stretch, xscale=0.5, yscale=1.0)
         self.assertRaises(ValueError,
                           VImageAdapter(image).stretch, xscale=1.0, yscale=0.5)
 
+    def test_stretch_matches_affine(self):
+        # Whole-number scales use zoom, which must replicate pixels exactly
+        # like nearest neighbour affine.
+        random = numpy.random.RandomState(seed=0)
+        for width, height in [(16, 16), (5, 3)]:
+            array = random.randint(0, 256, size=width * height * 4)
+            image = VImageAdapter.from_numpy_array(
+                array=array, width=width, height=height, bands=4,
+                format=BandFormat.UCHAR
+            )
+            for xscale, yscale in [(2, 2), (2, 1), (3, 5)]:
+                stretched = VImageAdapter(image).stretch(xscale=xscale,
+                                                         yscale=yscale)
+                expected = VImageAdapter(image)._scale(
+                    xscale=xscale, yscale=yscale, output_size=None,
+                    interpolate='near'
+                )
+                self.assertEqual((stretched.width, stretched.height),
+                                 (expected.width, expected.height))
+                self.assertEqual(bytes(stretched.write_to_memory()),
+                                 bytes(expected.write_to_memory()))
+
     def test_shrink_affine(self):
         image = VImageAdapter.new_rgba(width=16, height=16)
 
@@ -127,6 +161,58 @@ class TestVImageAdapter(unittest.TestCase):
         self.assertRaises(ValueError,
                           VImageAdapter(image).shrink_affine, xscale=1.0, yscale=2.0)
 
+    def test_shrink(self):
+        image = VImageAdapter.new_rgba(width=16, height=16)
+
+        # No shrink
+        shrunk = VImageAdapter(image).shrink(xscale=1.0, yscale=1.0)
+        self.assertEqual(shrunk.width, image.width)
+        self.assertEqual(shrunk.height, image.height)
+
+        # Both directions
+        shrunk = VImageAdapter(image).shrink(xscale=0.25, yscale=0.5)
+        self.assertEqual(shrunk.width, image.width * 0.25)
+        self.assertEqual(shrunk.height, image.height * 0.5)
+
+        # Not a whole fraction
+        shrunk = VImageAdapter(image).shrink(xscale=0.75, yscale=0.5)
+        self.assertEqual(shrunk.width, image.width * 0.75)
+        self.assertEqual(shrunk.height, image.height * 0.5)
+
+        # Partial blocks at the edges are dropped, like shrink_affine
+        image = VImageAdapter.new_rgba(width=15, height=17)
+        shrunk = VImageAdapter(image).shrink(xscale=0.5, yscale=0.5)
+        self.assertEqual(shrunk.width, 7)
+        self.assertEqual(shrunk.height, 8)
+
+        # Out of bounds
+        self.assertRaises(ValueError,
+                          VImageAdapter(image).shrink, xscale=0.0, yscale=1.0)
+        self.assertRaises(ValueError,
+                          VImageAdapter(image).shrink, xscale=2.0, yscale=1.0)
+
+    def test_shrink_matches_affine(self):
+        # Halving averages the same 2x2 blocks as shrink_affine, but VIPS
+        # rounds after shrinking each direction, so pixels may differ by 1.
+        array = numpy.random.RandomState(seed=0).randint(
+            0, 256, size=16 * 16 * 4
+        )
+        image = VImageAdapter.from_numpy_array(
+            array=array, width=16, height=16, bands=4,
+            format=BandFormat.UCHAR
+        )
+        shrunk = VImageAdapter(image).shrink(xscale=0.5, yscale=0.5)
+        expected = VImageAdapter(image).shrink_affine(xscale=0.5, yscale=0.5)
+        self.assertEqual((shrunk.width, shrunk.height),
+                         (expected.width, expected.height))
+        difference = (
+            numpy.frombuffer(shrunk.write_to_memory(),
+                             dtype=numpy.uint8).astype(int) -
+            numpy.frombuffer(expected.write_to_memory(),
+                             dtype=numpy.uint8).astype(int)
+        )
+        self.assertLessEqual(numpy.abs(difference).max(), 1)
+
     def test_tms_align(self):
         image = VImageAdapter.new_rgba(width=16, height=16)
 
@@ -148,6 +234,13 @@ class TestVImageAdapter(unittest.TestCase):
         self.assertEqual(result.width, image.width * 2)
         self.assertEqual(result.height, image.height * 2)
 
+        # Spanning by an odd number of pixels in the X direction: half of it
+        # still needs a border tile, or the last column would be cut off.
+        result = VImageAdapter(image).tms_align(tile_width=16, tile_height=16,
+                                 offset=XY(1 + 1 / 16, 1))
+        self.assertEqual(result.width, image.width * 2)
+        self.assertEqual(result.height, image.height)
+
 
 class TestVipsDataset(GdalTestCase):
     def setUp(self):